@@ -1,5 +1,5 @@
-from typing import Dict, Optional
-from pydantic import BaseModel, model_validator, SecretStr, Field
+from typing import Dict, Literal, Optional
+from pydantic import BaseModel, ConfigDict, model_validator, SecretStr, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class ModelConfig(BaseModel):
@@ -10,6 +10,12 @@ class ModelConfig(BaseModel):
     trust_remote_code: bool = False
     query_instruction_template: str 
     default_task: str = "Given a web search query, retrieve relevant passages that answer the query"
+    # Inference dtype for the torch backend; "auto" uses fp16 on CUDA and fp32 otherwise
+    precision: Literal["auto", "fp32", "fp16", "bf16"] = "auto"
+    # sentence-transformers backend; "onnx"/"openvino" need the matching extras installed
+    backend: Literal["torch", "onnx", "openvino"] = "torch"
+
+    model_config = ConfigDict(frozen=True)
 
 class Settings(BaseSettings):
     # Security
@@ -19,17 +25,41 @@ class Settings(BaseSettings):
     es_host: str = Field(default="http://es:9200", alias="ELASTICSEARCH_HOST")
     es_username: str = Field(default="elastic", alias="ELASTICSEARCH_USERNAME")
     es_password: str = Field(default="changeme", alias="ELASTIC_PASSWORD")
+    # Keep-alive connections per ES node, shared by all stores
+    es_pool_size: int = Field(default=64, alias="ELASTICSEARCH_POOL_SIZE")
     
     # Indices
     chat_index: str = "chat-index"
     semantic_index: str = "semantic-index"
+    # "byte" stores int8-quantized vectors (4x smaller than "float").
+    # Only applied when an index is created; existing indices must be recreated.
+    es_element_type: Literal["float", "byte"] = Field(alias="ELASTICSEARCH_ELEMENT_TYPE", default="float")
+    # HNSW index type for float vectors; "int8_hnsw" keeps an int8-quantized copy
+    # for graph traversal and rescoring while _source keeps the full floats.
+    # Migration: indices created before this setting use "cosine"/"hnsw" and keep
+    # working as-is; delete and let the service recreate them (the sync job
+    # re-indexes chat data) to pick up dot_product + quantized HNSW.
+    es_index_type: Literal["hnsw", "int8_hnsw", "int4_hnsw"] = Field(alias="ELASTICSEARCH_INDEX_TYPE", default="int8_hnsw")
 
     # Database & Sync
     database_url: str = Field(alias="DATABASE_URL", default="")
     sync_interval_minutes: int = Field(alias="SYNC_INTERVAL_MINUTES", default=60)
     
+    # Embedding cache: number of (model, prompt, text) embeddings kept in memory (0 disables)
+    embed_cache_size: int = Field(alias="EMBED_CACHE_SIZE", default=4096)
+    # Micro-batching: concurrent embed calls within this window share one model.encode call
+    embed_max_batch: int = Field(alias="EMBED_MAX_BATCH", default=64)
+    embed_max_wait_ms: float = Field(alias="EMBED_MAX_WAIT_MS", default=8)
+    # Concurrent model.encode calls; 1 suits a GPU, CPU hosts may gain from a few with fewer threads each
+    encode_concurrency: int = Field(alias="EMBED_ENCODE_CONCURRENCY", default=1)
+
     # Search
     min_relevance_score: float = Field(alias="MIN_RELEVANCE_SCORE", default=0.5)
+    # Default kNN num_candidates (HNSW candidates per shard); raise for recall, lower for latency
+    knn_num_candidates: int = Field(alias="KNN_NUM_CANDIDATES", default=50)
+    # Identical search requests within this window are served from memory (0 disables)
+    search_cache_ttl_seconds: int = Field(alias="SEARCH_CACHE_TTL_SECONDS", default=60)
+    search_cache_size: int = 1024
 
     # Models
     default_model_type: str = "qwen"
@@ -42,7 +72,8 @@ class Settings(BaseSettings):
         )
     }
 
-    model_config = SettingsConfigDict(env_prefix="EMBED_", env_file=".env", extra="ignore")
+    # Frozen: values are read once at startup and cached by callers (e.g. default_model_config)
+    model_config = SettingsConfigDict(env_prefix="EMBED_", env_file=".env", extra="ignore", frozen=True)
 
     @model_validator(mode='after')
     def check_default_model_exists(self) -> 'Settings':
@@ -51,3 +82,6 @@ class Settings(BaseSettings):
         return self
 
 settings = Settings()
+
+# Resolved once; settings are not modified after startup
+default_model_config = settings.models[settings.default_model_type]
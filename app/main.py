@@ -1,7 +1,9 @@
 from contextlib import asynccontextmanager
 import asyncio
+import hmac
 import logging
 from fastapi import FastAPI, Security, HTTPException, status
+from fastapi.responses import ORJSONResponse
 from fastapi.security import APIKeyHeader
 from config import settings
 
@@ -9,16 +11,31 @@ from config import settings
 logging.basicConfig(level=logging.INFO)
 
 from services.embedder import embedder
-from services.vector_store import chat_store, semantic_store
-from services.sync_to_embed import start_scheduler
+from services.vector_store import chat_store, semantic_store, close_client
+from services.sync_to_embed import start_scheduler, close_pool
 from routers import embed, chat, semantic
 
+logger = logging.getLogger(__name__)
+
+async def warmup():
+    """
+    Runs one batch through the default model and one kNN query so the first
+    real request does not pay for kernel setup or loading the HNSW graph.
+    """
+    try:
+        # Distinct texts: embed() dedupes within a call, so repeats would encode a batch of one
+        vectors = await embedder.embed([f"warmup {i}" for i in range(8)], settings.default_model_type)
+        await chat_store.search(vector=vectors[0], top_k=1)
+    except Exception as e:
+        logger.warning(f"Warmup failed: {e}")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     embedder.load_models()
     
     await chat_store.create_index()
     await semantic_store.create_index()
+    await warmup()
     
     sync_task = asyncio.create_task(start_scheduler())
     
@@ -30,15 +47,26 @@ async def lifespan(app: FastAPI):
     except asyncio.CancelledError:
         pass
     
+    await close_pool()
+    await embedder.close()
     await chat_store.close()
     await semantic_store.close()
+    await close_client()
 
-app = FastAPI(title="RAG & Embedding API", version="1.0.0", lifespan=lifespan)
+app = FastAPI(
+    title="RAG & Embedding API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
 
 api_key_header = APIKeyHeader(name="x-api-key", auto_error=False)
 
+# Resolved once; the secret does not change for the lifetime of the process
+_API_KEY_BYTES = settings.api_key.get_secret_value().encode()
+
 async def verify_api_key(key: str = Security(api_key_header)):
-    if key == settings.api_key.get_secret_value():
+    if key and hmac.compare_digest(key.encode(), _API_KEY_BYTES):
         return key
     raise HTTPException(
         status_code=status.HTTP_403_FORBIDDEN,
@@ -3,11 +3,25 @@ from fastapi import APIRouter
 from schemas.chat import ChatIndexRequest, ChatSearchRequest, ChatSearchResult
 from services.embedder import embedder
 from services.vector_store import chat_store
-from config import settings
-from dateutil import parser
+from config import settings, default_model_config
+from utils import AsyncTTLCache, build_prompt, parse_datetime
+
+_search_cache = AsyncTTLCache(maxsize=settings.search_cache_size, ttl=settings.search_cache_ttl_seconds)
 
 router = APIRouter(prefix="/chat", tags=["Chat Memory"])
 
+def _build_filters(req: ChatSearchRequest) -> dict:
+    filters = {}
+    if req.property_id:
+        filters["property_id"] = req.property_id
+    if req.host_id:
+        filters["host_id"] = req.host_id
+    if req.guest_id:
+        filters["guest_id"] = req.guest_id
+    if req.category:
+        filters["category"] = req.category
+    return filters
+
 @router.post("/index")
 async def index_chat(req: ChatIndexRequest):
     model_name = settings.default_model_type
@@ -31,28 +45,23 @@ async def index_chat(req: ChatIndexRequest):
 
 @router.post("/search", response_model=List[ChatSearchResult])
 async def search_chat(req: ChatSearchRequest):
+    return await _search_cache.get_or_compute(req.model_dump_json(), lambda: _search_chat(req))
+
+async def _search_chat(req: ChatSearchRequest) -> List[ChatSearchResult]:
     model_name = settings.default_model_type
-    config = settings.models.get(model_name)
     
-    prompt = config.query_instruction_template.format(task="Retrieve similar past Q&A")
+    prompt = build_prompt(default_model_config.query_instruction_template, "Retrieve similar past Q&A")
     embeddings = await embedder.embed([req.query], model_name, prompt=prompt)
     
-    filters = {
-        k: v for k, v in {
-            "property_id": req.property_id,
-            "host_id": req.host_id,
-            "guest_id": req.guest_id,
-            "category": req.category
-        }.items() if v
-    }
+    filters = _build_filters(req)
         
     range_filters = {}
     if req.date_from or req.date_to:
         date_range = {}
         if req.date_from:
-            date_range["gte"] = parser.parse(req.date_from).isoformat()
+            date_range["gte"] = parse_datetime(req.date_from).isoformat()
         if req.date_to:
-            date_range["lte"] = parser.parse(req.date_to).isoformat()
+            date_range["lte"] = parse_datetime(req.date_to).isoformat()
         range_filters["created_at"] = date_range
     
     results = await chat_store.search(
@@ -62,17 +71,8 @@ async def search_chat(req: ChatSearchRequest):
         range_filters=range_filters
     )
     
+    # Hits come from our own mapping and were validated on the way in
     return [
-        ChatSearchResult(
-            score=res.get("score", 0.0),
-            question=res.get("question", ""),
-            answer=res.get("answer", ""),
-            property_id=res.get("property_id", ""),
-            message_id=res.get("message_id"),
-            host_id=res.get("host_id"),
-            guest_id=res.get("guest_id"),
-            category=res.get("category"),
-            created_at=res.get("created_at"),
-            updated_at=res.get("updated_at")
-        ) for res in results if res.get("score", 0.0) >= settings.min_relevance_score
-    ]
\ No newline at end of file
+        ChatSearchResult.model_construct(**res)
+        for res in results if res.get("score", 0.0) >= settings.min_relevance_score
+    ]
@@ -1,7 +1,9 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import ORJSONResponse
 from schemas.common import EmbedRequest, EmbedResponse
 from services.embedder import embedder
-from config import settings
+from config import settings, default_model_config
+from utils import build_prompt
 
 router = APIRouter(tags=["Embedding"])
 
@@ -9,15 +11,15 @@ router = APIRouter(tags=["Embedding"])
 async def embed_documents(req: EmbedRequest):
     model_name = settings.default_model_type
     embeddings = await embedder.embed(req.texts, model_name)
-    return EmbedResponse(embeddings=embeddings, model=model_name)
+    # Numpy embeddings go straight to orjson; EmbedResponse documents the shape
+    return ORJSONResponse({"embeddings": embeddings, "model": model_name})
 
 @router.post("/query", response_model=EmbedResponse)
 async def embed_query(req: EmbedRequest):
     model_name = settings.default_model_type
-    config = settings.models.get(model_name)
     
-    task = req.task or config.default_task
-    prompt = config.query_instruction_template.format(task=task)
+    task = req.task or default_model_config.default_task
+    prompt = build_prompt(default_model_config.query_instruction_template, task)
     
     embeddings = await embedder.embed(req.texts, model_name, prompt=prompt)
-    return EmbedResponse(embeddings=embeddings, model=model_name)
\ No newline at end of file
+    return ORJSONResponse({"embeddings": embeddings, "model": model_name})
\ No newline at end of file
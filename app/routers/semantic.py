@@ -3,8 +3,10 @@ from fastapi import APIRouter
 from schemas.article import SemanticIndexRequest, SemanticSearchRequest, SemanticSearchResult
 from services.embedder import embedder
 from services.vector_store import semantic_store
-from config import settings
-from dateutil import parser
+from config import settings, default_model_config
+from utils import AsyncTTLCache, build_prompt, parse_datetime
+
+_search_cache = AsyncTTLCache(maxsize=settings.search_cache_size, ttl=settings.search_cache_ttl_seconds)
 
 router = APIRouter(prefix="/semantic", tags=["Semantic Search"])
 
@@ -28,11 +30,13 @@ async def index_semantic(req: SemanticIndexRequest):
 
 @router.post("/search", response_model=List[SemanticSearchResult])
 async def search_semantic(req: SemanticSearchRequest):
+    return await _search_cache.get_or_compute(req.model_dump_json(), lambda: _search_semantic(req))
+
+async def _search_semantic(req: SemanticSearchRequest) -> List[SemanticSearchResult]:
     model_name = settings.default_model_type
-    config = settings.models.get(model_name)
     
     # Embed Query
-    prompt = config.query_instruction_template.format(task="Retrieve relevant articles")
+    prompt = build_prompt(default_model_config.query_instruction_template, "Retrieve relevant articles")
     embeddings = await embedder.embed([req.query], model_name, prompt=prompt)
     
     # 1. Range Filters (Timestamp)
@@ -40,10 +44,10 @@ async def search_semantic(req: SemanticSearchRequest):
     if req.date_from or req.date_to:
         ts_range = {}
         if req.date_from:
-            dt = parser.parse(req.date_from)
+            dt = parse_datetime(req.date_from)
             ts_range["gte"] = int(dt.timestamp() * 1000)
         if req.date_to:
-            dt = parser.parse(req.date_to)
+            dt = parse_datetime(req.date_to)
             ts_range["lte"] = int(dt.timestamp() * 1000)
         range_filters["timestamp"] = ts_range
 
@@ -64,9 +68,10 @@ async def search_semantic(req: SemanticSearchRequest):
         include_embeddings=req.include_embeddings
     )
     
+    # Hits come from our own mapping and were validated on the way in
     mapped_results = []
     for res in results:
-        mapped_results.append(SemanticSearchResult(
+        mapped_results.append(SemanticSearchResult.model_construct(
             chunk=res["text"],
             score=res["score"],
             id=res["id"],
@@ -74,7 +79,7 @@ async def search_semantic(req: SemanticSearchRequest):
             timestamp=res["timestamp"],
             tag=res["tag"],
             type=res["type"],
-            embedding=res["embedding"]
+            embedding=res.get("embedding")
         ))
         
     return mapped_results
\ No newline at end of file
@@ -1,5 +1,5 @@
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 class SemanticIndexRequest(BaseModel):
     chunk: str
@@ -9,6 +9,8 @@ class SemanticIndexRequest(BaseModel):
     tag: List[str]
     type: str
 
+    model_config = ConfigDict(frozen=True)
+
 class SemanticSearchRequest(BaseModel):
     query: str
     size: int = 5
@@ -19,6 +21,8 @@ class SemanticSearchRequest(BaseModel):
     ids: Optional[List[str]] = None
     include_embeddings: bool = False
 
+    model_config = ConfigDict(frozen=True)
+
 class SemanticSearchResult(BaseModel):
     chunk: str
     score: float
@@ -27,4 +31,6 @@ class SemanticSearchResult(BaseModel):
     timestamp: int
     tag: List[str]
     type: str
-    embedding: Optional[List[float]] = None
\ No newline at end of file
+    embedding: Optional[List[float]] = None
+
+    model_config = ConfigDict(frozen=True)
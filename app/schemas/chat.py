@@ -1,5 +1,5 @@
 from typing import Optional
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 class ChatIndexRequest(BaseModel):
     question: str
@@ -12,6 +12,8 @@ class ChatIndexRequest(BaseModel):
     created_at: Optional[str] = None
     updated_at: Optional[str] = None
 
+    model_config = ConfigDict(frozen=True)
+
 class ChatSearchRequest(BaseModel):
     query: str
     size: int = 5
@@ -22,6 +24,8 @@ class ChatSearchRequest(BaseModel):
     date_from: Optional[str] = None  # YYYY-MM-DD...
     date_to: Optional[str] = None
 
+    model_config = ConfigDict(frozen=True)
+
 class ChatSearchResult(BaseModel):
     score: float
     question: str
@@ -33,3 +37,5 @@ class ChatSearchResult(BaseModel):
     host_id: Optional[str] = Field(default=None, exclude=True)
     guest_id: Optional[str] = Field(default=None, exclude=True)
     created_at: Optional[str] = Field(default=None, exclude=True)
+
+    model_config = ConfigDict(frozen=True)
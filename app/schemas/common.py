@@ -1,10 +1,14 @@
 from typing import List, Optional, Dict, Any
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 
 class EmbedRequest(BaseModel):
-    texts: List[str]
+    texts: List[str] = Field(min_length=1, max_length=1024)
     task: Optional[str] = None
 
+    model_config = ConfigDict(frozen=True)
+
 class EmbedResponse(BaseModel):
     embeddings: List[List[float]]
-    model: str
\ No newline at end of file
+    model: str
+
+    model_config = ConfigDict(frozen=True)
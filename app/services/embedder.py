@@ -1,42 +1,245 @@
+import asyncio
 import logging
-from typing import List, Optional
-from sentence_transformers import SentenceTransformer
+import os
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+import numpy as np
+from cachetools import LRUCache
 from fastapi.concurrency import run_in_threadpool
 from config import settings
+from utils import collect_batch
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
 
 logger = logging.getLogger(__name__)
 
+# Micro-batching: concurrent embed() calls arriving within MAX_WAIT_MS of each
+# other are coalesced into a single model.encode call per (model, prompt).
+MAX_BATCH = settings.embed_max_batch
+MAX_WAIT_MS = settings.embed_max_wait_ms
+
+def _torch_dtype(precision: str):
+    """Maps ModelConfig.precision to a torch dtype, or None to keep the default fp32."""
+    import torch
+
+    if precision == "auto":
+        return torch.float16 if torch.cuda.is_available() else None
+    return {"fp32": None, "fp16": torch.float16, "bf16": torch.bfloat16}[precision]
+
 class EmbedderService:
     def __init__(self):
         self.models = {}
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+        # Bounds concurrent model.encode calls so they do not oversubscribe the CPU/GPU
+        self._encode_slots = asyncio.Semaphore(settings.encode_concurrency)
+        self._running: Set[asyncio.Task] = set()
+        self._load_lock = threading.Lock()
+        # Keyed by (model_name, prompt, text); read and written from threadpool workers
+        self._cache = LRUCache(maxsize=settings.embed_cache_size) if settings.embed_cache_size > 0 else None
+        self._cache_lock = threading.Lock()
+        # Models loaded in fp16/bf16, whose outputs are re-normalized in fp32
+        self._reduced_precision = set()
+        # Identical embed() calls currently being computed, keyed by (model, prompt, texts)
+        self._inflight: Dict[Tuple[str, Optional[str], Tuple[str, ...]], asyncio.Future] = {}
     
+    def _load_one(self, name: str) -> "SentenceTransformer":
+        # Deferred so importing this module does not pull in torch/transformers
+        from sentence_transformers import SentenceTransformer
+
+        config = settings.models[name]
+        logger.info(f"Loading model: {name} ({config.repo_id})...")
+        model_kwargs = {}
+        dtype = _torch_dtype(config.precision) if config.backend == "torch" else None
+        if dtype is not None:
+            model_kwargs["dtype"] = dtype
+            self._reduced_precision.add(name)
+        model = SentenceTransformer(
+            config.repo_id, 
+            trust_remote_code=config.trust_remote_code,
+            backend=config.backend,
+            model_kwargs=model_kwargs
+        )
+        if config.max_seq_length:
+            model.max_seq_length = config.max_seq_length
+        self.models[name] = model
+        logger.info(f"Model {name} loaded successfully.")
+        return model
+
     def load_models(self):
-        for name, config in settings.models.items():
-            if config.enabled:
-                logger.info(f"Loading model: {name} ({config.repo_id})...")
-                try:
-                    model = SentenceTransformer(
-                        config.repo_id, 
-                        trust_remote_code=config.trust_remote_code
-                    )
-                    if config.max_seq_length:
-                        model.max_seq_length = config.max_seq_length
-                    self.models[name] = model
-                    logger.info(f"Model {name} loaded successfully.")
-                except Exception as e:
-                    logger.error(f"Failed to load model {name}: {e}")
-                    if name == settings.default_model_type:
-                        raise RuntimeError(f"Critical: Failed to load default model '{name}'") from e
+        """
+        Preloads the default model. Other enabled models are loaded on first use.
+        """
+        if settings.encode_concurrency > 1:
+            import torch
 
-    def _encode_sync(self, model_name: str, texts: List[str], prompt: Optional[str] = None) -> List[List[float]]:
+            # Split the cores between the concurrent encoders instead of each using all of them
+            torch.set_num_threads(max(1, (os.cpu_count() or 1) // settings.encode_concurrency))
+
+        name = settings.default_model_type
+        if settings.models[name].enabled:
+            try:
+                self._load_one(name)
+            except Exception as e:
+                logger.error(f"Failed to load model {name}: {e}")
+                raise RuntimeError(f"Critical: Failed to load default model '{name}'") from e
+
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._batch_worker())
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        for task in list(self._running):
+            task.cancel()
+
+    def _get_or_load(self, model_name: str) -> "SentenceTransformer":
         model = self.models.get(model_name)
-        if not model:
+        if model is not None:
+            return model
+
+        config = settings.models.get(model_name)
+        if config is None or not config.enabled:
             raise ValueError(f"Model {model_name} not loaded")
-        
-        embeddings = model.encode(texts, prompt=prompt, normalize_embeddings=True)
-        return embeddings.tolist()
 
-    async def embed(self, texts: List[str], model_name: str, prompt: Optional[str] = None) -> List[List[float]]:
-        return await run_in_threadpool(self._encode_sync, model_name, texts, prompt)
+        with self._load_lock:
+            model = self.models.get(model_name)
+            if model is None:
+                try:
+                    model = self._load_one(model_name)
+                except Exception as e:
+                    logger.error(f"Failed to load model {model_name}: {e}")
+                    raise
+        return model
+
+    def _run_model(self, model_name: str, model: "SentenceTransformer", texts: List[str], prompt: Optional[str]) -> np.ndarray:
+        embeddings = model.encode(
+            texts,
+            prompt=prompt,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+            # Caps each forward pass at EMBED_MAX_BATCH texts; larger inputs (an /embed
+            # call may carry up to 1024) run as several passes to bound activation memory
+            batch_size=MAX_BATCH
+        )
+        # Kept as a float32 matrix; serialized directly by orjson / the ES client
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if model_name in self._reduced_precision:
+            # Half-precision normalization is off by ~1e-3, too far for ES dot_product's unit-length check
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings
+
+    def _encode_sync(self, model_name: str, texts: List[str], prompt: Optional[str] = None) -> np.ndarray:
+        model = self._get_or_load(model_name)
+        if self._cache is None:
+            return self._run_model(model_name, model, texts, prompt)
+
+        keys = [(model_name, prompt, text) for text in texts]
+        with self._cache_lock:
+            cached = [self._cache.get(key) for key in keys]
+        missing = [i for i, row in enumerate(cached) if row is None]
+
+        computed = None
+        if missing:
+            computed = self._run_model(model_name, model, [texts[i] for i in missing], prompt)
+            with self._cache_lock:
+                for i, row in zip(missing, computed):
+                    # Copied so a cached row does not keep the whole batch alive
+                    row = row.copy()
+                    row.flags.writeable = False
+                    self._cache[keys[i]] = row
+            if len(missing) == len(texts):
+                return computed
+
+        dim = computed.shape[1] if computed is not None else cached[0].shape[0]
+        embeddings = np.empty((len(texts), dim), dtype=np.float32)
+        for i, row in enumerate(cached):
+            if row is not None:
+                embeddings[i] = row
+        if computed is not None:
+            embeddings[missing] = computed
+        return embeddings
+
+    async def _batch_worker(self):
+        while True:
+            # A slot is taken before collecting, so while every encoder is busy
+            # new requests pile up into the next (larger) batch
+            await self._encode_slots.acquire()
+            try:
+                pending = await collect_batch(self._queue, MAX_BATCH, MAX_WAIT_MS / 1000)
+            except BaseException:
+                self._encode_slots.release()
+                raise
+
+            task = asyncio.create_task(self._run_batch(pending))
+            self._running.add(task)
+            task.add_done_callback(self._batch_done)
+
+    def _batch_done(self, task: asyncio.Task):
+        self._running.discard(task)
+        self._encode_slots.release()
+
+    async def _run_batch(self, pending: List[tuple]):
+        groups = {}
+        for item in pending:
+            model_name, prompt, _, _ = item
+            groups.setdefault((model_name, prompt), []).append(item)
+
+        for (model_name, prompt), items in groups.items():
+            texts = [text for _, _, item_texts, _ in items for text in item_texts]
+            try:
+                embeddings = await run_in_threadpool(self._encode_sync, model_name, texts, prompt)
+            except Exception as e:
+                for _, _, _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            offset = 0
+            for _, _, item_texts, future in items:
+                if not future.done():
+                    future.set_result(embeddings[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+
+    async def embed(self, texts: List[str], model_name: str, prompt: Optional[str] = None) -> np.ndarray:
+        """
+        Embeds texts with the given model and prompt. Identical calls that overlap
+        share one computation; the returned matrix must be treated as read-only.
+        """
+        if not texts:
+            return np.empty((0, settings.models[model_name].embedding_dim), dtype=np.float32)
+
+        # Duplicates within one call are embedded once and fanned back out in input order
+        unique = list(dict.fromkeys(texts))
+        if len(unique) < len(texts):
+            positions = {text: i for i, text in enumerate(unique)}
+            embeddings = await self.embed(unique, model_name, prompt)
+            return embeddings[[positions[text] for text in texts]]
+
+        key = (model_name, prompt, tuple(texts))
+        task = self._inflight.get(key)
+        if task is None:
+            # No lock needed: lookup and insert happen without yielding to the event loop
+            task = asyncio.ensure_future(self._embed(texts, model_name, prompt))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded so one caller going away does not cancel the others
+        return await asyncio.shield(task)
+
+    async def _embed(self, texts: List[str], model_name: str, prompt: Optional[str]) -> np.ndarray:
+        if self._worker is None:
+            async with self._encode_slots:
+                return await run_in_threadpool(self._encode_sync, model_name, texts, prompt)
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((model_name, prompt, texts, future))
+        return await future
 
 embedder = EmbedderService()
@@ -1,7 +1,7 @@
 import asyncio
 import logging
 from datetime import datetime, timezone, timedelta
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 import asyncpg
 
@@ -11,15 +11,16 @@ from services.vector_store import chat_store
 
 logger = logging.getLogger(__name__)
 
+# Ids and text columns are cast/defaulted in SQL so rows map straight onto ES documents
 SYNC_QUERY = """
     SELECT 
-        m._id AS message_id,
-        m.content AS question,
-        COALESCE(ar."editedResponse", ar."suggestedResponse") AS answer,
-        bg.id AS guest_id,
-        b.home_id AS property_id,
-        h.workspace_id AS host_id,
-        ar."messageCategory" AS category,
+        m._id::text AS message_id,
+        COALESCE(m.content, '') AS question,
+        COALESCE(ar."editedResponse", ar."suggestedResponse", '') AS answer,
+        bg.id::text AS guest_id,
+        b.home_id::text AS property_id,
+        h.workspace_id::text AS host_id,
+        NULLIF(ar."messageCategory"::text, '') AS category,
         ar.created_at AS created_at,
         ar.updated_at AS updated_at
     FROM 
@@ -40,13 +41,34 @@ SYNC_QUERY = """
     LIMIT 1000;
 """
 
-BATCH_SIZE = 1 # 
+BATCH_SIZE = 64
 
-def _ensure_timezone(dt: datetime) -> datetime:
-    """Ensure datetime object has timezone information (UTC if missing)."""
-    if dt.tzinfo is None:
-        return dt.replace(tzinfo=timezone.utc)
-    return dt
+_UTC = timezone.utc
+
+_pool: Optional[asyncpg.Pool] = None
+
+async def _get_pool() -> asyncpg.Pool:
+    """
+    Lazily creates the shared Postgres pool. Keeping the connection alive
+    between sync cycles avoids reconnecting and lets asyncpg reuse the
+    prepared SYNC_QUERY statement.
+    """
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            settings.database_url,
+            min_size=1,
+            max_size=4,
+            statement_cache_size=256,
+            server_settings={"application_name": "arm-03-sync"}
+        )
+    return _pool
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
 
 async def sync_chat_data():
     """
@@ -66,55 +88,53 @@ async def sync_chat_data():
         
         logger.info(f"Last synced timestamp: {last_ts_ms} ({last_sync_dt} UTC naive)")
 
-        conn = await asyncpg.connect(settings.database_url)
+        pool = await _get_pool()
+        rows = await pool.fetch(SYNC_QUERY, last_sync_dt)
+        total_rows = len(rows)
+        logger.info(f"Fetched {total_rows} new records to sync.")
+
+        if not rows:
+            return
+
+        # Refreshes are paused while the batches load and resume afterwards
+        async with chat_store.bulk_ingest():
+            # Bulk write of the previous batch, running while the next one is embedded
+            pending_index: Optional[asyncio.Task] = None
+            try:
+                for i in range(0, total_rows, BATCH_SIZE):
+                    batch = rows[i:i + BATCH_SIZE]
+
+                    texts_to_embed: List[str] = []
+                    docs_to_index: List[Dict[str, Any]] = []
+
+                    for row in batch:
+                        doc = dict(row)
+                        texts_to_embed.append(f"Q: {doc['question']}\nA: {doc['answer']}")
+
+                        doc["_id"] = doc["message_id"]
+                        # PG timestamps are naive UTC; attach tzinfo so ES gets an explicit offset
+                        created_at, updated_at = doc["created_at"], doc["updated_at"]
+                        doc["created_at"] = (created_at if created_at.tzinfo else created_at.replace(tzinfo=_UTC)).isoformat()
+                        doc["updated_at"] = (updated_at if updated_at.tzinfo else updated_at.replace(tzinfo=_UTC)).isoformat()
+                        docs_to_index.append(doc)
+
+                    embeddings = await embedder.embed(texts_to_embed, settings.default_model_type)
+                    if pending_index is not None:
+                        await pending_index
+                    pending_index = asyncio.create_task(chat_store.bulk_index(docs_to_index, embeddings))
+
+                if pending_index is not None:
+                    await pending_index
+            finally:
+                # On failure, no write may outlive bulk_ingest(); re-running the sync is
+                # idempotent since docs are keyed by message_id
+                if pending_index is not None:
+                    if not pending_index.done():
+                        pending_index.cancel()
+                    await asyncio.gather(pending_index, return_exceptions=True)
+
+        logger.info(f"Successfully synced {total_rows} records.")
 
-        try:
-            rows = await conn.fetch(SYNC_QUERY, last_sync_dt)
-            total_rows = len(rows)
-            logger.info(f"Fetched {total_rows} new records to sync.")
-
-            if not rows:
-                return
-
-            for i in range(0, total_rows, BATCH_SIZE):
-                batch = rows[i:i + BATCH_SIZE]
-                
-                texts_to_embed: List[str] = []
-                docs_to_index: List[Dict[str, Any]] = []
-
-                for row in batch:
-                    question = row['question'] or ""
-                    answer = row['answer'] or ""
-                    
-                    texts_to_embed.append(f"Q: {question}\nA: {answer}")
-                    
-                    updated_at = _ensure_timezone(row['updated_at'])
-                    created_at = _ensure_timezone(row['created_at'])
-                    
-                    docs_to_index.append({
-                        "_id": str(row['message_id']),
-                        "message_id": str(row['message_id']),
-                        "question": question,
-                        "answer": answer,
-                        "guest_id": str(row['guest_id']) if row['guest_id'] else None,
-                        "property_id": str(row['property_id']),
-                        "host_id": str(row['host_id']),
-                        "category": str(row['category']) if row['category'] else None,
-                        "created_at": created_at.isoformat(),
-                        "updated_at": updated_at.isoformat()
-                    })
-                
-                embeddings = await embedder.embed(texts_to_embed, settings.default_model_type)
-                
-                for doc, emb in zip(docs_to_index, embeddings):
-                    doc["embedding"] = emb
-                
-                await chat_store.bulk_index(docs_to_index)
-                
-            logger.info(f"Successfully synced {total_rows} records.")
-
-        finally:
-            await conn.close()
 
     except Exception as e:
         logger.error(f"Error during chat sync: {e}", exc_info=True)
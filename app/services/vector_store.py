@@ -1,44 +1,302 @@
+import asyncio
 import logging
 from abc import ABC, abstractmethod
-from typing import List, Optional, Dict, Any
+from contextlib import asynccontextmanager
+from typing import List, Optional, Dict, Any, Set
+import numpy as np
+import orjson
 from elasticsearch import AsyncElasticsearch, helpers
-from config import settings
+from elasticsearch.serializer import NdjsonSerializer, OrjsonSerializer
+from config import settings, default_model_config
+from utils import collect_batch
 
 logger = logging.getLogger(__name__)
 
+# Single-document index() calls are queued and flushed together in one bulk
+# request once BULK_MAX docs are waiting or BULK_LINGER_MS has passed.
+BULK_MAX = 500
+BULK_LINGER_MS = 50
+# Retries for documents rejected with 429 (bulk queue full)
+BULK_RETRIES = 3
+BULK_BACKOFF_SECONDS = 2
+
+def _to_es_vector(vector):
+    """
+    Converts an embedding into the representation stored in the index.
+    With element_type "byte" the (L2-normalized) vector is scaled to signed int8.
+    """
+    if settings.es_element_type == "byte":
+        scaled = np.rint(np.asarray(vector, dtype=np.float32) * 127)
+        return np.clip(scaled, -128, 127).astype(np.int8)
+    return vector
+
+class _OrjsonNdjsonSerializer(NdjsonSerializer):
+    """NDJSON counterpart of OrjsonSerializer, used for _msearch bodies."""
+    def json_dumps(self, data: Any) -> bytes:
+        return orjson.dumps(data, default=self.default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+    def json_loads(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+logger.info(f"Connecting to Elasticsearch at {settings.es_host}")
+# Shared by every store so they all draw on one keep-alive connection pool
+_client = AsyncElasticsearch(
+    settings.es_host,
+    basic_auth=(settings.es_username, settings.es_password),
+    http_compress=True,
+    connections_per_node=settings.es_pool_size,
+    request_timeout=30,
+    # orjson writes numpy vectors directly, without building Python float lists
+    serializers={
+        OrjsonSerializer.mimetype: OrjsonSerializer(),
+        NdjsonSerializer.mimetype: _OrjsonNdjsonSerializer()
+    }
+)
+
+async def close_client():
+    await _client.close()
+
+def _embedding_mapping(dim: int) -> Dict[str, Any]:
+    """
+    dense_vector mapping for the 'embedding' field.
+    Float vectors are unit length (normalize_embeddings=True), so dot_product
+    ranks exactly like cosine without the per-comparison normalization, and
+    HNSW keeps a quantized copy of them (settings.es_index_type).
+    Byte vectors are scaled to int8 and no longer unit length, so they stay on cosine.
+    """
+    if settings.es_element_type == "byte":
+        return {
+            "type": "dense_vector",
+            "dims": dim,
+            "element_type": "byte",
+            "index": True,
+            "similarity": "cosine",
+            "index_options": {"type": "hnsw", "m": 16, "ef_construction": 100}
+        }
+    return {
+        "type": "dense_vector",
+        "dims": dim,
+        "element_type": "float",
+        "index": True,
+        "similarity": "dot_product",
+        "index_options": {"type": settings.es_index_type, "m": 16, "ef_construction": 100}
+    }
+
+# Static part of every kNN clause; copied per query and filled in
+_KNN_SKELETON = {"field": "embedding", "query_vector": None, "k": 0, "num_candidates": 0}
+
+# ES caps num_candidates at 10000
+_MAX_NUM_CANDIDATES = 10000
+
+def _knn_clause(vector, top_k: int, filter_clauses: List[Dict[str, Any]],
+                num_candidates: Optional[int] = None) -> Dict[str, Any]:
+    """
+    num_candidates is the HNSW beam width per shard (ES's ef_search): higher
+    values improve recall and cost latency roughly linearly. Defaults to
+    settings.knn_num_candidates, doubled when filtering since HNSW has to
+    skip the nodes the filter excludes.
+    """
+    if num_candidates is None:
+        num_candidates = settings.knn_num_candidates * (2 if filter_clauses else 1)
+
+    knn_query = _KNN_SKELETON.copy()
+    knn_query["query_vector"] = _to_es_vector(vector)
+    knn_query["k"] = top_k
+    knn_query["num_candidates"] = min(max(num_candidates, top_k), _MAX_NUM_CANDIDATES)
+    if filter_clauses:
+        # Always one bool filter, so every filtered search has the same shape
+        knn_query["filter"] = {"bool": {"filter": filter_clauses}}
+    return knn_query
+
 class BaseVectorStore(ABC):
-    def __init__(self, index_name: str):
+    # Index names confirmed to exist, shared by all stores on the cluster
+    _existing_indices: Set[str] = set()
+
+    def __init__(self, index_name: str, client: Optional[AsyncElasticsearch] = None):
         self.index_name = index_name
-        logger.info(f"Connecting to Elasticsearch at {settings.es_host}")
-        self.client = AsyncElasticsearch(
-            settings.es_host,
-            basic_auth=(settings.es_username, settings.es_password)
-        )
+        self.client = client or _client
+        self._index_queue: asyncio.Queue = asyncio.Queue()
+        self._flusher: Optional[asyncio.Task] = None
 
     async def close(self):
-        await self.client.close()
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        # The shared client is closed once via close_client()
+        if self.client is not _client:
+            await self.client.close()
+
+    async def _enqueue(self, doc_id: Optional[str], doc: Dict[str, Any]):
+        """
+        Queues a document for the next coalesced bulk request and waits until
+        Elasticsearch has acknowledged it.
+        """
+        # Started on first use since the stores are created before the event loop exists
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+        future = asyncio.get_running_loop().create_future()
+        action = {"_index": self.index_name, "_id": doc_id, "_source": doc}
+        self._index_queue.put_nowait((action, future))
+        await future
+
+    async def _flush_loop(self):
+        while True:
+            pending = await collect_batch(self._index_queue, BULK_MAX, BULK_LINGER_MS / 1000)
+            await self._flush(pending)
+
+    async def _flush(self, pending: List[tuple]):
+        """
+        Sends one bulk request for the queued (action, future) pairs and resolves
+        each future with its own document's result. Documents rejected with 429
+        are retried here, up to BULK_RETRIES times with exponential backoff.
+        """
+        for attempt in range(BULK_RETRIES + 1):
+            # With the helper's own retries off (max_retries=0) it yields exactly one
+            # result per action, in action order; its retries would reorder them
+            results = []
+            try:
+                async for result in helpers.async_streaming_bulk(
+                    self.client, [action for action, _ in pending], chunk_size=BULK_MAX,
+                    max_retries=0, raise_on_error=False, refresh=False
+                ):
+                    results.append(result)
+                if len(results) != len(pending):
+                    raise RuntimeError(f"Bulk returned {len(results)} results for {len(pending)} documents")
+            except Exception as e:
+                logger.error(f"Coalesced bulk indexing failed: {e}")
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            retry = []
+            for (action, future), (ok, info) in zip(pending, results):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(info)
+                elif attempt < BULK_RETRIES and next(iter(info.values())).get("status") == 429:
+                    retry.append((action, future))
+                else:
+                    future.set_exception(helpers.BulkIndexError("1 document(s) failed to index.", [info]))
+
+            if not retry:
+                return
+            pending = retry
+            await asyncio.sleep(BULK_BACKOFF_SECONDS * 2 ** attempt)
+
+    @staticmethod
+    def _parse_hits(resp: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Returns each hit's _source (already limited by the query) with its 'score' added."""
+        results = []
+        for hit in resp["hits"]["hits"]:
+            source = hit["_source"]
+            source["score"] = hit["_score"]
+            results.append(source)
+        return results
+
+    async def _msearch(self, queries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Sends the queries against this index in one _msearch request and
+        returns the per-query responses in the same order.
+        """
+        searches = []
+        for query in queries:
+            searches.append({"index": self.index_name})
+            searches.append(query)
+        resp = await self.client.msearch(searches=searches)
+
+        responses = resp["responses"]
+        for item in responses:
+            if "error" in item:
+                raise RuntimeError(f"Search failed within msearch: {item['error']}")
+        return responses
+
+    async def _index_exists(self) -> bool:
+        """
+        Checks whether the index exists. Only a positive answer is cached, so a
+        missing index is looked up again until create_index has made it.
+        """
+        if self.index_name in self._existing_indices:
+            return True
+        if await self.client.indices.exists(index=self.index_name):
+            self._existing_indices.add(self.index_name)
+            return True
+        return False
+
+    @asynccontextmanager
+    async def bulk_ingest(self):
+        """
+        Disables periodic refreshes for the duration of a bulk load and restores
+        the previous refresh_interval afterwards (None resets it to the ES default).
+        """
+        resp = await self.client.indices.get_settings(index=self.index_name, name="index.refresh_interval")
+        previous = resp.get(self.index_name, {}).get("settings", {}).get("index", {}).get("refresh_interval")
+        if previous == "-1":
+            # Left over from a load that was killed before it could restore; never put "-1" back
+            logger.warning(f"Index {self.index_name} already had refreshes disabled; restoring the ES default afterwards")
+            previous = None
+        await self.client.indices.put_settings(index=self.index_name, settings={"index": {"refresh_interval": "-1"}})
+        try:
+            yield
+        finally:
+            await self.client.indices.put_settings(index=self.index_name, settings={"index": {"refresh_interval": previous}})
+
+    async def force_merge(self, max_num_segments: int = 1):
+        """
+        Merges the index down to max_num_segments. Each segment carries its own
+        HNSW graph, so fewer segments means fewer graphs per kNN query.
+        Expensive; meant for after large imports, not for every sync.
+        """
+        logger.info(f"Force merging {self.index_name} to {max_num_segments} segment(s)")
+        await self.client.indices.forcemerge(index=self.index_name, max_num_segments=max_num_segments)
 
     @abstractmethod
     async def create_index(self, dim: Optional[int] = None):
         pass
 
 class ChatVectorStore(BaseVectorStore):
+    # Shared, never-mutated parts of the search body
+    _SOURCE = {"excludes": ["embedding"]}
+    _RESCORE = {
+        "window_size": 50,
+        "query": {
+            "rescore_query": {
+                "function_score": {
+                    "score_mode": "multiply",
+                    "functions": [
+                        {
+                            "gauss": {
+                                "updated_at": {
+                                    "origin": "now",
+                                    "scale": "30d",
+                                    "decay": 0.5
+                                }
+                            }
+                        }
+                    ]
+                }
+            },
+            "query_weight": 0.7,
+            "rescore_query_weight": 0.3
+        }
+    }
+
     async def create_index(self, dim: Optional[int] = None):
         if dim is None:
-            dim = settings.models[settings.default_model_type].embedding_dim
+            dim = default_model_config.embedding_dim
 
-        exists = await self.client.indices.exists(index=self.index_name)
-        if not exists:
+        if not await self._index_exists():
             logger.info(f"Creating Chat index: {self.index_name} with dim {dim}")
             mapping = {
                 "mappings": {
                     "properties": {
-                        "embedding": {
-                            "type": "dense_vector",
-                            "dims": dim,
-                            "index": True,
-                            "similarity": "cosine"
-                        },
+                        "embedding": _embedding_mapping(dim),
                         "message_id": {"type": "keyword"},
                         "question": {"type": "text", "index": False},
                         "answer": {"type": "text", "index": False},
@@ -52,6 +310,7 @@ class ChatVectorStore(BaseVectorStore):
                 }
             }
             await self.client.indices.create(index=self.index_name, body=mapping)
+            self._existing_indices.add(self.index_name)
             
     async def get_latest_timestamp(self) -> int:
         """
@@ -59,7 +318,7 @@ class ChatVectorStore(BaseVectorStore):
         Returns 0 if the index is empty or doesn't exist.
         """
         try:
-            if not await self.client.indices.exists(index=self.index_name):
+            if not await self._index_exists():
                 return 0
                 
             resp = await self.client.search(
@@ -77,22 +336,39 @@ class ChatVectorStore(BaseVectorStore):
             logger.error(f"Error fetching latest timestamp: {e}")
             return 0
 
-    async def bulk_index(self, docs: List[Dict[str, Any]]):
+    async def bulk_index(self, docs: List[Dict[str, Any]], embeddings: Optional[np.ndarray] = None):
         """
         Bulk indexes a list of documents.
         docs: List of dicts containing the document fields.
         Expected to have '_id' key for specific doc ID.
+        embeddings: Optional (len(docs), dim) matrix. Row i becomes the 'embedding'
+        of docs[i]; otherwise each doc must carry its own 'embedding'.
         """
-        actions = [
-            {
-                "_index": self.index_name,
-                "_id": doc.pop("_id", None),
-                "_source": doc
-            }
-            for doc in docs
-        ]
+        if embeddings is not None:
+            # Whole matrix converted in one vectorized step, rows attached lazily
+            vectors = _to_es_vector(embeddings)
+        else:
+            vectors = [_to_es_vector(doc["embedding"]) for doc in docs]
+
+        def _actions():
+            for doc, vector in zip(docs, vectors):
+                doc["embedding"] = vector
+                yield {
+                    "_index": self.index_name,
+                    "_id": doc.pop("_id", None),
+                    "_source": doc
+                }
+
+        success, failed = 0, 0
         try:
-            success, failed = await helpers.async_bulk(self.client, actions, refresh=True)
+            # Streams actions in chunks of at most ~10MB instead of serializing them all up front
+            async for ok, _ in helpers.async_streaming_bulk(
+                self.client, _actions(), max_chunk_bytes=10 * 1024 * 1024, refresh=False
+            ):
+                if ok:
+                    success += 1
+                else:
+                    failed += 1
             logger.info(f"Bulk indexed {success} documents. Failed: {failed}")
             return success
         except Exception as e:
@@ -101,93 +377,67 @@ class ChatVectorStore(BaseVectorStore):
 
     async def index(self, vector: list, question: str, answer: str, **kwargs):
         doc = {
-            "embedding": vector,
+            "embedding": _to_es_vector(vector),
             "question": question,
             "answer": answer,
             **kwargs
         }
         doc_id = kwargs.get("message_id")
-        await self.client.index(index=self.index_name, document=doc, id=doc_id)
+        await self._enqueue(doc_id, doc)
 
-    async def search(self, vector: list, top_k: int = 5, 
-                    filters: Optional[Dict[str, Any]] = None,
-                    range_filters: Optional[Dict[str, Dict[str, Any]]] = None):
-        knn_query = {
-            "field": "embedding",
-            "query_vector": vector,
-            "k": top_k,
-            "num_candidates": max(100, top_k * 10)
-        }
-
-        filter_clauses = []
+    def _build_query(self, vector: list, top_k: int,
+                     filters: Optional[Dict[str, Any]],
+                     range_filters: Optional[Dict[str, Dict[str, Any]]],
+                     num_candidates: Optional[int]) -> Dict[str, Any]:
+        filter_clauses = [
+            *[{"term": {key: value}} for key, value in (filters or {}).items() if value is not None],
+            *[{"range": {key: ranges}} for key, ranges in (range_filters or {}).items()]
+        ]
 
-        if filters:
-            for key, value in filters.items():
-                if value is not None:
-                    filter_clauses.append({"term": {key: value}})
-        
-        if range_filters:
-            for key, ranges in range_filters.items():
-                filter_clauses.append({"range": {key: ranges}})
-
-        if filter_clauses:
-             knn_query["filter"] = filter_clauses if len(filter_clauses) > 1 else filter_clauses[0]
-
-        query = {
-            "knn": knn_query,
-            "_source": True,
-            "rescore": {
-                "window_size": 50,
-                "query": {
-                    "rescore_query": {
-                        "function_score": {
-                            "score_mode": "multiply",
-                            "functions": [
-                                {
-                                    "gauss": {
-                                        "updated_at": {
-                                            "origin": "now",
-                                            "scale": "30d",
-                                            "decay": 0.5
-                                        }
-                                    }
-                                }
-                            ]
-                        }
-                    },
-                    "query_weight": 0.7,
-                    "rescore_query_weight": 0.3
-                }
-            }
+        return {
+            "knn": _knn_clause(vector, top_k, filter_clauses, num_candidates),
+            "_source": self._SOURCE,
+            "rescore": self._RESCORE
         }
-        
+
+    async def search(self, vector: list, top_k: int = 5, 
+                    filters: Optional[Dict[str, Any]] = None,
+                    range_filters: Optional[Dict[str, Dict[str, Any]]] = None,
+                    num_candidates: Optional[int] = None):
+        """
+        Returns the source of each hit plus its 'score'. The stored 'embedding'
+        is never returned; it is the bulk of every document.
+        """
+        query = self._build_query(vector, top_k, filters, range_filters, num_candidates)
         resp = await self.client.search(index=self.index_name, body=query)
-        
-        results = []
-        for hit in resp["hits"]["hits"]:
-            source = hit["_source"]
-            source["score"] = hit["_score"]
-            results.append(source)
-        return results
+        return self._parse_hits(resp)
+
+    async def msearch(self, vectors: List[list], top_k: int = 5,
+                      filters: Optional[Dict[str, Any]] = None,
+                      range_filters: Optional[Dict[str, Dict[str, Any]]] = None,
+                      num_candidates: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Runs one kNN search per vector in a single _msearch request.
+        The same filters apply to every search; results are returned in vector order.
+        """
+        queries = [self._build_query(vector, top_k, filters, range_filters, num_candidates) for vector in vectors]
+        return [self._parse_hits(resp) for resp in await self._msearch(queries)]
 
 class SemanticVectorStore(BaseVectorStore):
+    _SOURCE = ["text", "id", "chunk_id", "timestamp", "tag", "type"]
+    _SOURCE_WITH_EMBEDDING = _SOURCE + ["embedding"]
+
     async def create_index(self, dim: Optional[int] = None):
         if dim is None:
-            dim = settings.models[settings.default_model_type].embedding_dim
+            dim = default_model_config.embedding_dim
 
-        exists = await self.client.indices.exists(index=self.index_name)
-        if not exists:
+        if not await self._index_exists():
             logger.info(f"Creating Semantic index: {self.index_name} with dim {dim}")
             mapping = {
                 "mappings": {
                     "properties": {
                         "text": {"type": "text"},
-                        "embedding": {
-                            "type": "dense_vector",
-                            "dims": dim,
-                            "index": True,
-                            "similarity": "cosine"
-                        },
+                        "embedding": _embedding_mapping(dim),
                         "timestamp": {"type": "date", "format": "epoch_millis"}, 
                         "id": {"type": "keyword"},
                         "chunk_id": {"type": "integer"},
@@ -197,6 +447,7 @@ class SemanticVectorStore(BaseVectorStore):
                 }
             }
             await self.client.indices.create(index=self.index_name, body=mapping)
+            self._existing_indices.add(self.index_name)
 
     async def index(self, chunk: str, vector: list, id: str, chunk_id: int, 
                    timestamp: int, tag: List[str], type: str):
@@ -204,66 +455,57 @@ class SemanticVectorStore(BaseVectorStore):
         doc_id = f"{id}_{chunk_id}"
         doc = {
             "text": chunk,
-            "embedding": vector,
+            "embedding": _to_es_vector(vector),
             "id": id,
             "chunk_id": chunk_id,
             "timestamp": timestamp,
             "tag": tag,
             "type": type
         }
-        await self.client.index(index=self.index_name, document=doc, id=doc_id)
+        await self._enqueue(doc_id, doc)
+
+    def _build_query(self, vector: list, top_k: int,
+                     range_filters: Optional[Dict[str, Dict[str, Any]]],
+                     terms_filters: Optional[Dict[str, List[Any]]],
+                     include_embeddings: bool,
+                     num_candidates: Optional[int]) -> Dict[str, Any]:
+        filter_clauses = [
+            *[{"terms": {key: values}} for key, values in (terms_filters or {}).items() if values],
+            *[{"range": {key: ranges}} for key, ranges in (range_filters or {}).items()]
+        ]
+
+        return {
+            "knn": _knn_clause(vector, top_k, filter_clauses, num_candidates),
+            "_source": self._SOURCE_WITH_EMBEDDING if include_embeddings else self._SOURCE
+        }
 
     async def search(self, vector: list, top_k: int = 5, 
                     range_filters: Optional[Dict[str, Dict[str, Any]]] = None,
                     terms_filters: Optional[Dict[str, List[Any]]] = None,
-                    include_embeddings: bool = False):
-        
-        knn_query = {
-            "field": "embedding",
-            "query_vector": vector,
-            "k": top_k,
-            "num_candidates": max(100, top_k * 10)
-        }
-
-        filter_clauses = []
-
-        if terms_filters:
-            for key, values in terms_filters.items():
-                if values:
-                    filter_clauses.append({"terms": {key: values}})
-
-        if range_filters:
-            for key, ranges in range_filters.items():
-                filter_clauses.append({"range": {key: ranges}})
-
-        if filter_clauses:
-             knn_query["filter"] = filter_clauses if len(filter_clauses) > 1 else filter_clauses[0]
-
-        fields = ["text", "id", "chunk_id", "timestamp", "tag", "type"]
-        if include_embeddings:
-            fields.append("embedding")
-
-        query = {
-            "knn": knn_query,
-            "_source": fields
-        }
-        
+                    include_embeddings: bool = False,
+                    num_candidates: Optional[int] = None):
+        """
+        Returns the listed source fields of each hit plus its 'score'.
+        'embedding' is only fetched (and present) when include_embeddings is True.
+        """
+        query = self._build_query(vector, top_k, range_filters, terms_filters, include_embeddings, num_candidates)
         resp = await self.client.search(index=self.index_name, body=query)
-        
-        results = []
-        for hit in resp["hits"]["hits"]:
-            source = hit["_source"]
-            results.append({
-                "score": hit["_score"],
-                "text": source.get("text", ""),
-                "id": source.get("id"),
-                "chunk_id": source.get("chunk_id"),
-                "timestamp": source.get("timestamp"),
-                "tag": source.get("tag", []),
-                "type": source.get("type"),
-                "embedding": source.get("embedding") if include_embeddings else None
-            })
-        return results
+        return self._parse_hits(resp)
+
+    async def msearch(self, vectors: List[list], top_k: int = 5,
+                      range_filters: Optional[Dict[str, Dict[str, Any]]] = None,
+                      terms_filters: Optional[Dict[str, List[Any]]] = None,
+                      include_embeddings: bool = False,
+                      num_candidates: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Runs one kNN search per vector in a single _msearch request.
+        The same filters apply to every search; results are returned in vector order.
+        """
+        queries = [
+            self._build_query(vector, top_k, range_filters, terms_filters, include_embeddings, num_candidates)
+            for vector in vectors
+        ]
+        return [self._parse_hits(resp) for resp in await self._msearch(queries)]
 
 # Instances
 chat_store = ChatVectorStore(index_name=settings.chat_index)
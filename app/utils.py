@@ -0,0 +1,72 @@
+import asyncio
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+from cachetools import TTLCache
+from dateutil import parser
+
+@lru_cache(maxsize=128)
+def build_prompt(template: str, task: str) -> str:
+    """Format a query instruction template. Task strings are a small, mostly fixed set."""
+    return template.format(task=task)
+
+def parse_datetime(value: str) -> datetime:
+    """Parses ISO-8601 input (e.g. YYYY-MM-DD HH:MM:SS) natively, falling back to dateutil for anything else."""
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return parser.parse(value)
+
+async def collect_batch(queue: asyncio.Queue, max_items: int, max_wait: float) -> List[Any]:
+    """
+    Waits for the first item on the queue, then keeps draining it until
+    max_items are collected or max_wait seconds have passed since the first item.
+    """
+    batch = [await queue.get()]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_wait
+
+    while len(batch) < max_items:
+        if not queue.empty():
+            batch.append(queue.get_nowait())
+            continue
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), timeout))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+_MISSING = object()
+
+class AsyncTTLCache:
+    """
+    In-process TTL cache for async computations. Concurrent misses on the
+    same key wait for a single computation instead of each running it.
+    A ttl of 0 disables caching.
+    """
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl) if ttl > 0 else None
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        if self._cache is None:
+            return await compute()
+
+        value = self._cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                value = self._cache.get(key, _MISSING)
+                if value is _MISSING:
+                    value = await compute()
+                    self._cache[key] = value
+        finally:
+            if self._locks.get(key) is lock and not lock.locked():
+                del self._locks[key]
+        return value